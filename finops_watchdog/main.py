@@ -4,20 +4,49 @@
 from __future__ import annotations
 
 import csv
+import hashlib
 import io
 import json
+import operator
+import os
 import re
+import zipfile
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Sequence
 
 import click
-import pandas as pd
-import yaml
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 
 SCHEMA_VERSION = "1.0"
 
+CACHE_ENV_VAR = "FINOPS_CACHE"
+
+_STREAM_CHUNK_ROWS = 100_000
+_UTC_ISO_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+_WINDOW_RE = re.compile(r"([1-9]\d*)d")
+
+_CSV_FIELDNAMES = (
+    "timestamp",
+    "group",
+    "baseline",
+    "current",
+    "delta",
+    "delta_pct",
+    "severity",
+    "anomaly_type",
+)
+_csv_row = operator.itemgetter(*_CSV_FIELDNAMES)
+
+# Shared label objects: every anomaly dict references one of these instead of a per-row copy.
+_SEVERITY_LABELS = ("medium", "high", "critical")
+_ANOMALY_TYPE = "spend_above_threshold"
+
 
 class InputFileError(Exception):
     """Raised when the input file cannot be opened or read."""
@@ -27,6 +56,14 @@ class SchemaDataError(Exception):
     """Raised when CSV schema or data is invalid."""
 
 
+class _GroupDtypeMismatch(SchemaDataError):
+    """Raised by --streaming when a later chunk needs a wider group column type."""
+
+    def __init__(self, wider_dtype: Any) -> None:
+        super().__init__(f"group column needs type {wider_dtype}")
+        self.wider_dtype = wider_dtype
+
+
 @dataclass(frozen=True)
 class DetectConfig:
     """Runtime configuration for a detect invocation."""
@@ -41,6 +78,7 @@ class DetectConfig:
     min_amount: float
     output_format: str
     report_path: Path | None = None
+    streaming: bool = False
 
 
 @click.group()
@@ -101,6 +139,12 @@ def _window_callback(_: click.Context, __: click.Option, value: str) -> str:
     default=None,
     help="Write a human-readable markdown anomaly summary to this file.",
 )
+@click.option(
+    "--streaming",
+    is_flag=True,
+    default=False,
+    help="Read the input in chunks with bounded memory. Rows must be in timestamp order within each group.",
+)
 @click.pass_context
 def detect(
     ctx: click.Context,
@@ -113,6 +157,7 @@ def detect(
     threshold: float,
     min_amount: float,
     report_path: Path | None,
+    streaming: bool,
 ) -> None:
     """Detect spend anomalies from a local CSV file."""
 
@@ -127,10 +172,11 @@ def detect(
         threshold=threshold,
         min_amount=min_amount,
         report_path=report_path,
+        streaming=streaming,
     )
 
     try:
-        payload = _run_detection(config)
+        payload = _run_detection_streaming(config) if config.streaming else _run_detection(config)
         _emit_payload(payload, config.output_format)
         if config.report_path is not None:
             _write_markdown_report(payload, config.report_path)
@@ -148,20 +194,14 @@ def detect(
 
 
 def _parse_window_days(window: str) -> int:
-    match = re.fullmatch(r"([1-9]\d*)d", window.strip().lower())
+    match = _WINDOW_RE.fullmatch(window.strip().lower())
     if not match:
         raise ValueError("window must match <days>d, for example 30d")
     return int(match.group(1))
 
 
 def _run_detection(config: DetectConfig) -> Dict[str, Any]:
-    data = _load_csv(config.input_path)
-    prepared = _prepare_dataframe(
-        data,
-        time_column=config.time_column,
-        value_column=config.value_column,
-        group_by=config.group_by,
-    )
+    prepared = _load_prepared(config)
     anomalies = _detect_anomalies(
         prepared,
         window_days=config.window_days,
@@ -171,14 +211,181 @@ def _run_detection(config: DetectConfig) -> Dict[str, Any]:
     return _build_payload(config, anomalies)
 
 
+def _run_detection_streaming(config: DetectConfig) -> Dict[str, Any]:
+    group_dtype = None
+    while True:
+        try:
+            anomalies = _stream_anomalies(config, group_dtype)
+        except _GroupDtypeMismatch as exc:
+            # A later chunk needs a wider group type than the chunks before it, as a full parse would
+            # have inferred for the whole column; rerun from the top with it so group labels match.
+            group_dtype = exc.wider_dtype
+            continue
+        return _build_payload(config, anomalies)
+
+
+def _stream_anomalies(config: DetectConfig, group_dtype: Any) -> List[Dict[str, Any]]:
+    import pandas as pd
+
+    anomalies: List[Dict[str, Any]] = []
+    carry: pd.DataFrame | None = None
+    time_format: str | None = None
+
+    chunks = _iter_csv_chunks(
+        config.input_path,
+        group_by=config.group_by,
+        group_dtype=group_dtype,
+        chunk_rows=_STREAM_CHUNK_ROWS,
+    )
+    for index, chunk in enumerate(chunks):
+        if index == 0:
+            time_format = _guess_time_format(chunk, config.time_column)
+        prepared = _prepare_dataframe(
+            chunk,
+            time_column=config.time_column,
+            value_column=config.value_column,
+            group_by=config.group_by,
+            time_format=time_format,
+        ).assign(fresh=True)
+
+        if carry is None:
+            frame = prepared
+        else:
+            _check_stream_order(carry, prepared)
+            frame = pd.concat([carry.assign(fresh=False), prepared], ignore_index=True)
+            frame = frame.sort_values(["group", "timestamp"], kind="stable", ignore_index=True)
+
+        anomalies.extend(
+            _detect_anomalies(
+                frame,
+                window_days=config.window_days,
+                threshold=config.threshold,
+                min_amount=config.min_amount,
+                eligible=frame["fresh"].to_numpy(),
+            )
+        )
+        # Each group's trailing window is all the history the next chunk's baselines need.
+        carry = frame.groupby("group", sort=False, observed=True).tail(config.window_days)
+
+    anomalies.sort(key=operator.itemgetter("timestamp", "group"))
+    return anomalies
+
+
+def _check_stream_order(carry: pd.DataFrame, prepared: pd.DataFrame) -> None:
+    last_seen = carry.groupby("group", sort=False, observed=True)["timestamp"].max()
+    first_new = prepared.groupby("group", sort=False, observed=True)["timestamp"].min()
+    last_seen.index = last_seen.index.astype(str)
+    first_new.index = first_new.index.astype(str)
+
+    if (first_new.reindex(last_seen.index) < last_seen).any():
+        raise SchemaDataError("--streaming requires rows in timestamp order within each group")
+
+
+def _load_prepared(config: DetectConfig) -> pd.DataFrame:
+    columns = (config.time_column, config.value_column, config.group_by)
+    _check_input_file(config.input_path)
+
+    cache_path = _cache_path_for(config.input_path, columns) if os.environ.get(CACHE_ENV_VAR) == "1" else None
+    if cache_path is not None:
+        cached = _read_cache(cache_path)
+        if cached is not None:
+            return cached
+
+    prepared = _prepare_dataframe(
+        _load_csv(config.input_path),
+        time_column=config.time_column,
+        value_column=config.value_column,
+        group_by=config.group_by,
+    )
+    if cache_path is not None:
+        _write_cache(prepared, cache_path)
+    return prepared
+
+
 def _load_csv(path: Path) -> pd.DataFrame:
+    import pandas as pd
+
+    _check_input_file(path)
+
+    # No usecols: with it pandas stops checking field counts, so ragged rows would be silently truncated.
+    with _translate_read_errors(path):
+        return pd.read_csv(path)
+
+
+def _guess_time_format(chunk: pd.DataFrame, time_column: str) -> str | None:
+    try:
+        from pandas.tseries.api import guess_datetime_format
+    except ImportError:  # pandas < 2.2
+        from pandas._libs.tslibs.parsing import guess_datetime_format
+
+    # The same guess pd.to_datetime makes from a column's first non-null value, taken once for the whole stream.
+    if time_column not in chunk.columns:
+        return None
+    values = chunk[time_column].dropna()
+    if values.empty or not isinstance(values.iloc[0], str):
+        return None
+    return guess_datetime_format(values.iloc[0])
+
+
+def _iter_csv_chunks(
+    path: Path,
+    *,
+    group_by: str,
+    group_dtype: Any,
+    chunk_rows: int,
+) -> Iterator[pd.DataFrame]:
+    import pandas as pd
+
+    _check_input_file(path)
+    if group_dtype is None:
+        # Pin the first chunk's inferred group dtype; inferred per chunk, a group of 1 would become "1"
+        # in one chunk and "1.0" in a chunk that also holds 1.5.
+        with _translate_read_errors(path):
+            first = pd.read_csv(path, nrows=chunk_rows)
+        if group_by not in first.columns:
+            yield first  # _prepare_dataframe reports the missing column
+            return
+        group_dtype = first[group_by].dtype
+
+    with _translate_read_errors(path):
+        try:
+            with pd.read_csv(path, chunksize=chunk_rows, dtype={group_by: group_dtype}) as reader:
+                yield from reader
+        except (pd.errors.ParserError, UnicodeDecodeError):
+            raise
+        except ValueError as exc:
+            wider_dtype = _wider_group_dtype(group_dtype)
+            if wider_dtype is None:
+                raise
+            raise _GroupDtypeMismatch(wider_dtype) from exc
+
+
+def _wider_group_dtype(dtype: Any) -> Any:
+    import pandas as pd
+
+    # The promotions a full-column parse makes: ints widen to float, anything else falls back to text.
+    if pd.api.types.is_integer_dtype(dtype):
+        return "float64"
+    if pd.api.types.is_string_dtype(dtype):
+        return None
+    return str
+
+
+def _check_input_file(path: Path) -> None:
     if not path.exists():
         raise InputFileError(f"file not found: {path}")
     if not path.is_file():
         raise InputFileError(f"not a file: {path}")
 
+
+@contextmanager
+def _translate_read_errors(path: Path) -> Iterator[None]:
+    import pandas as pd
+
     try:
-        return pd.read_csv(path)
+        yield
+    except SchemaDataError:
+        raise
     except PermissionError as exc:
         raise InputFileError(f"unreadable file: {path}") from exc
     except FileNotFoundError as exc:
@@ -189,36 +396,109 @@ def _load_csv(path: Path) -> pd.DataFrame:
         raise InputFileError(f"failed to read CSV: {exc}") from exc
 
 
+def _cache_path_for(path: Path, columns: Sequence[str]) -> Path:
+    # "<source>-<version>.npz": source is the input path and column selection, version its mtime and size,
+    # so a new entry prunes only older versions of the same selection.
+    stat = path.stat()
+    selection = "\0".join([str(path.resolve()), *columns])
+    source = hashlib.blake2b(selection.encode("utf-8"), digest_size=8).hexdigest()
+    version = hashlib.blake2b(f"{stat.st_mtime_ns}:{stat.st_size}".encode("utf-8"), digest_size=8).hexdigest()
+    cache_root = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    return cache_root / "finops_watchdog" / f"{source}-{version}.npz"
+
+
+def _read_cache(cache_path: Path) -> pd.DataFrame | None:
+    import numpy as np
+    import pandas as pd
+
+    # Plain arrays only: allow_pickle=False means a planted cache file cannot execute code.
+    try:
+        with np.load(cache_path, allow_pickle=False) as entry:
+            timestamps, values = entry["timestamp"], entry["value"]
+            codes, categories = entry["group_codes"], entry["group_categories"]
+        if not (
+            timestamps.dtype.kind == "M"
+            and values.dtype.kind in "iuf"
+            and codes.dtype.kind in "iu"
+            and len(timestamps) == len(values) == len(codes)
+        ):
+            return None  # not an entry _write_cache produced; reparse and overwrite it
+        return pd.DataFrame(
+            {
+                "timestamp": pd.Series(timestamps).dt.tz_localize("UTC"),
+                "value": values,
+                "group": pd.Categorical.from_codes(codes, categories=categories),
+            }
+        )
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError, KeyError, zipfile.BadZipFile):
+        return None  # corrupt or stale-format entry; reparse and overwrite it
+
+
+def _write_cache(prepared: pd.DataFrame, cache_path: Path) -> None:
+    import numpy as np
+
+    groups = prepared["group"].cat
+    partial = cache_path.with_name(f"{cache_path.stem}.{os.getpid()}.tmp")
+    # Caching is best-effort: a read-only or full cache directory must never fail a detect run.
+    try:
+        cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        with partial.open("wb") as handle:
+            np.savez(
+                handle,
+                timestamp=prepared["timestamp"].dt.tz_convert(None).to_numpy(),
+                value=prepared["value"].to_numpy(),
+                group_codes=groups.codes.to_numpy(),
+                group_categories=np.asarray(groups.categories, dtype=str),
+            )
+        os.replace(partial, cache_path)
+        source = cache_path.name.split("-", 1)[0]
+        for stale in cache_path.parent.glob(f"{source}-*.npz"):
+            if stale != cache_path:
+                stale.unlink(missing_ok=True)
+    except OSError:
+        try:
+            partial.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+
 def _prepare_dataframe(
     dataframe: pd.DataFrame,
     *,
     time_column: str,
     value_column: str,
     group_by: str,
+    time_format: str | None = None,
 ) -> pd.DataFrame:
+    import pandas as pd
+
     required_columns = [time_column, value_column, group_by]
     missing = [column for column in required_columns if column not in dataframe.columns]
     if missing:
         raise SchemaDataError(f"missing required columns: {', '.join(missing)}")
 
-    prepared = dataframe[[time_column, value_column, group_by]].copy()
-    prepared.columns = ["timestamp", "value", "group"]
-
-    prepared["timestamp"] = pd.to_datetime(prepared["timestamp"], errors="coerce", utc=True)
-    if prepared["timestamp"].isna().any():
+    timestamps = pd.to_datetime(dataframe[time_column], errors="coerce", utc=True, format=time_format)
+    if timestamps.isna().any():
         raise SchemaDataError(f"invalid timestamp values in column '{time_column}'")
 
-    prepared["value"] = pd.to_numeric(prepared["value"], errors="coerce")
-    if prepared["value"].isna().any():
+    values = pd.to_numeric(dataframe[value_column], errors="coerce")
+    if values.isna().any():
         raise SchemaDataError(f"non-numeric values in column '{value_column}'")
 
-    if prepared["group"].isna().any():
+    groups = dataframe[group_by]
+    if groups.isna().any():
         raise SchemaDataError(f"missing group values in column '{group_by}'")
 
-    prepared["group"] = prepared["group"].astype(str)
-    prepared = prepared.sort_values(["group", "timestamp"]).reset_index(drop=True)
-
-    return prepared
+    prepared = pd.DataFrame(
+        {
+            "timestamp": timestamps,
+            "value": values,
+            "group": groups.astype(str).astype("category"),
+        }
+    )
+    return prepared.sort_values(["group", "timestamp"]).reset_index(drop=True)
 
 
 def _detect_anomalies(
@@ -227,63 +507,68 @@ def _detect_anomalies(
     window_days: int,
     threshold: float,
     min_amount: float,
+    eligible: np.ndarray | None = None,
 ) -> List[Dict[str, Any]]:
-    anomalies: List[Dict[str, Any]] = []
-
-    for group_value, group_frame in dataframe.groupby("group", sort=True):
-        ordered = group_frame.sort_values("timestamp").copy()
-
-        baseline = ordered["value"].shift(1).rolling(window=window_days, min_periods=window_days).mean()
-        rolling_std = ordered["value"].shift(1).rolling(window=window_days, min_periods=window_days).std(ddof=0)
-
-        ordered["baseline"] = baseline
-        ordered["rolling_std"] = rolling_std
-
-        for _, row in ordered.iterrows():
-            baseline_value = row["baseline"]
-            current_value = row["value"]
-            std_value = row["rolling_std"]
-
-            if pd.isna(baseline_value) or baseline_value <= 0:
-                continue
+    import numpy as np
+    import pandas as pd
 
-            delta = current_value - baseline_value
-            if delta <= 0 or delta < min_amount:
-                continue
-
-            if pd.isna(std_value) or std_value <= 0:
-                z_score = float("inf")
-            else:
-                z_score = delta / std_value
-
-            if z_score < threshold:
-                continue
-
-            delta_pct = (delta / baseline_value) * 100.0
-
-            anomalies.append(
-                {
-                    "timestamp": _to_utc_iso(row["timestamp"]),
-                    "group": group_value,
-                    "baseline": _rounded_float(baseline_value),
-                    "current": _rounded_float(current_value),
-                    "delta": _rounded_float(delta),
-                    "delta_pct": _rounded_float(delta_pct),
-                    "severity": _severity_for_score(z_score, threshold),
-                    "anomaly_type": "spend_above_threshold",
-                }
-            )
+    # _prepare_dataframe has already sorted by (group, timestamp), so groups are taken as they appear.
+    previous = dataframe.groupby("group", sort=False, observed=True)["value"].shift(1)
+    windows = previous.groupby(dataframe["group"], sort=False, observed=True).rolling(
+        window=window_days, min_periods=window_days
+    )
+    baseline = windows.mean().droplevel(0).sort_index().to_numpy()
+    rolling_std = windows.std(ddof=0).droplevel(0).sort_index().to_numpy()
+
+    current = dataframe["value"].to_numpy(dtype=float)
+    delta = current - baseline
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z_scores = np.where(rolling_std > 0, delta / rolling_std, np.inf)
+        mask = (baseline > 0) & (delta > 0) & (delta >= min_amount) & (z_scores >= threshold)
+        if eligible is not None:
+            mask &= eligible
+        delta_pct = (delta / baseline) * 100.0
+
+    selected = pd.DataFrame(
+        {
+            "timestamp": dataframe["timestamp"].loc[mask].dt.strftime(_UTC_ISO_FORMAT),
+            "group": dataframe["group"].loc[mask],
+            "baseline": baseline[mask],
+            "current": current[mask],
+            "delta": delta[mask],
+            "delta_pct": delta_pct[mask],
+            "z_score": z_scores[mask],
+        }
+    ).sort_values(["timestamp", "group"], kind="stable")
+
+    return [
+        {
+            "timestamp": timestamp,
+            "group": group_value,
+            "baseline": round(baseline_value, 4),
+            "current": round(current_value, 4),
+            "delta": round(delta_value, 4),
+            "delta_pct": round(pct_value, 4),
+            "severity": severity,
+            "anomaly_type": _ANOMALY_TYPE,
+        }
+        for timestamp, group_value, baseline_value, current_value, delta_value, pct_value, severity in zip(
+            selected["timestamp"].tolist(),
+            selected["group"].tolist(),
+            selected["baseline"].tolist(),
+            selected["current"].tolist(),
+            selected["delta"].tolist(),
+            selected["delta_pct"].tolist(),
+            _severity_labels(selected["z_score"].to_numpy(), threshold).tolist(),
+        )
+    ]
 
-    anomalies.sort(key=lambda item: (item["timestamp"], item["group"]))
-    return anomalies
 
+def _severity_labels(z_scores: np.ndarray, threshold: float) -> np.ndarray:
+    import numpy as np
 
-def _severity_for_score(z_score: float, threshold: float) -> str:
-    if z_score >= threshold * 2.0:
-        return "critical"
-    if z_score >= threshold * 1.5:
-        return "high"
-    return "medium"
+    levels = np.searchsorted([threshold * 1.5, threshold * 2.0], z_scores, side="right")
+    return np.array(_SEVERITY_LABELS, dtype=object)[levels]
 
 
 def _build_payload(config: DetectConfig, anomalies: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -302,7 +587,7 @@ def _build_payload(config: DetectConfig, anomalies: List[Dict[str, Any]]) -> Dic
         "summary": {
             "total_anomalies": len(anomalies),
             "groups_impacted": groups_impacted,
-            "max_delta_pct": _rounded_float(max_delta_pct),
+            "max_delta_pct": max_delta_pct,
         },
         "anomalies": anomalies,
     }
@@ -314,7 +599,11 @@ def _emit_payload(payload: Dict[str, Any], output_format: str) -> None:
         return
 
     if output_format == "yaml":
-        click.echo(yaml.safe_dump(payload, sort_keys=False))
+        import yaml
+
+        # libyaml's C emitter when PyYAML was built with it; same output as SafeDumper.
+        dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+        click.echo(yaml.dump(payload, Dumper=dumper, sort_keys=False))
         return
 
     if output_format == "csv":
@@ -368,41 +657,16 @@ def _write_markdown_report(payload: Dict[str, Any], path: Path) -> None:
 
 
 def _anomalies_to_csv(anomalies: List[Dict[str, Any]]) -> str:
-    fieldnames = [
-        "timestamp",
-        "group",
-        "baseline",
-        "current",
-        "delta",
-        "delta_pct",
-        "severity",
-        "anomaly_type",
-    ]
-
     buffer = io.StringIO()
-    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
-    writer.writeheader()
-    for anomaly in anomalies:
-        writer.writerow({key: anomaly.get(key) for key in fieldnames})
+    writer = csv.writer(buffer)
+    writer.writerow(_CSV_FIELDNAMES)
+    writer.writerows(map(_csv_row, anomalies))
 
     return buffer.getvalue()
 
 
-def _to_utc_iso(value: Any) -> str:
-    timestamp = pd.Timestamp(value)
-    if timestamp.tzinfo is None:
-        timestamp = timestamp.tz_localize("UTC")
-    else:
-        timestamp = timestamp.tz_convert("UTC")
-    return timestamp.to_pydatetime().replace(microsecond=0).isoformat().replace("+00:00", "Z")
-
-
 def _utc_now_iso() -> str:
-    return datetime.now(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
-
-
-def _rounded_float(value: Any) -> float:
-    return round(float(value), 4)
+    return datetime.now(timezone.utc).strftime(_UTC_ISO_FORMAT)
 
 
 if __name__ == "__main__":
@@ -3,57 +3,104 @@
 from __future__ import annotations
 
 import json
+import os
+import stat
+from functools import lru_cache
 from pathlib import Path
+from typing import Iterator
 
-from click.testing import CliRunner
+import numpy as np
+import pandas as pd
+import pytest
+from click.testing import CliRunner, Result
 
+from finops_watchdog import main
 from finops_watchdog.main import cli
 
 FIXTURES = Path(__file__).parent / "fixtures"
 
+# Single source for the CLI argv and the in-process DetectConfig, so the two paths cannot drift.
+_DETECT_SETTINGS = {
+    "time_column": "date",
+    "value_column": "amount",
+    "group_by": "SERVICE",
+    "window": "5d",
+    "threshold": 3.0,
+    "min_amount": 1.0,
+    "output_format": "json",
+}
 
-def _detect_args(input_name: str) -> list[str]:
-    return [
-        "detect",
-        "--input",
-        str(FIXTURES / input_name),
-        "--time-column",
-        "date",
-        "--value-column",
-        "amount",
-        "--group-by",
-        "SERVICE",
-        "--window",
-        "5d",
-        "--threshold",
-        "3.0",
-        "--min-amount",
-        "1",
-        "--output-format",
-        "json",
-    ]
-
-
-def test_detect_no_anomaly_flat_series() -> None:
-    runner = CliRunner()
-
-    result = runner.invoke(cli, _detect_args("no_anomaly.csv"))
 
-    assert result.exit_code == 0
-    payload = json.loads(result.output)
+@lru_cache(maxsize=None)
+def _detect_args(input_name: str) -> tuple[str, ...]:
+    args = ["detect", "--input", str(FIXTURES / input_name)]
+    for name, value in _DETECT_SETTINGS.items():
+        args += [f"--{name.replace('_', '-')}", str(value)]
+    return tuple(args)
+
+
+def _detect_config(input_name: str) -> main.DetectConfig:
+    return main.DetectConfig(
+        input_path=FIXTURES / input_name,
+        window_days=main._parse_window_days(_DETECT_SETTINGS["window"]),
+        **_DETECT_SETTINGS,
+    )
+
+
+def _without_generated_at(output: str) -> list[str]:
+    return [line for line in output.splitlines() if "generated_at" not in line]
+
+
+def _detect_payload(prepared: pd.DataFrame, input_name: str) -> dict:
+    """Run detection in-process on a ``prepared_frames`` entry with the settings of _detect_args."""
+    config = _detect_config(input_name)
+    anomalies = main._detect_anomalies(
+        prepared,
+        window_days=config.window_days,
+        threshold=config.threshold,
+        min_amount=config.min_amount,
+    )
+    return main._build_payload(config, anomalies)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _cache_disabled() -> Iterator[None]:
+    # A developer's exported FINOPS_CACHE=1 must not make the suite write into their real cache
+    # directory; the cache tests opt back in against a tmp_path.
+    with pytest.MonkeyPatch.context() as patch:
+        patch.delenv(main.CACHE_ENV_VAR, raising=False)
+        yield
+
+
+@pytest.fixture(scope="session")
+def runner() -> CliRunner:
+    return CliRunner()
+
+
+@pytest.fixture(scope="session")
+def prepared_frames() -> dict[str, pd.DataFrame]:
+    # Loaded through the CLI's own reader (with the cache off, see _cache_disabled).
+    return {name: main._load_prepared(_detect_config(name)) for name in ("no_anomaly.csv", "multi_group.csv")}
+
+
+@pytest.fixture(scope="session")
+def simple_spike_result(runner: CliRunner) -> tuple[Result, dict]:
+    result = runner.invoke(cli, _detect_args("simple_spike.csv"), catch_exceptions=False)
+    return result, json.loads(result.output)
+
+
+def test_detect_no_anomaly_flat_series(prepared_frames: dict[str, pd.DataFrame]) -> None:
+    payload = _detect_payload(prepared_frames["no_anomaly.csv"], "no_anomaly.csv")
+
     assert payload["summary"]["total_anomalies"] == 0
     assert payload["summary"]["groups_impacted"] == 0
     assert payload["anomalies"] == []
 
 
-def test_detect_simple_spike() -> None:
-    runner = CliRunner()
-
-    result = runner.invoke(cli, _detect_args("simple_spike.csv"))
+def test_detect_simple_spike(simple_spike_result: tuple[Result, dict]) -> None:
+    result, payload = simple_spike_result
 
     assert result.exit_code == 0
-    payload = json.loads(result.output)
-
     assert payload["summary"]["total_anomalies"] >= 1
     anomaly = payload["anomalies"][0]
     assert anomaly["group"] == "AmazonEC2"
@@ -62,13 +109,8 @@ def test_detect_simple_spike() -> None:
     assert anomaly["delta_pct"] > 0
 
 
-def test_detect_multi_group_grouped() -> None:
-    runner = CliRunner()
-
-    result = runner.invoke(cli, _detect_args("multi_group.csv"))
-
-    assert result.exit_code == 0
-    payload = json.loads(result.output)
+def test_detect_multi_group_grouped(prepared_frames: dict[str, pd.DataFrame]) -> None:
+    payload = _detect_payload(prepared_frames["multi_group.csv"], "multi_group.csv")
 
     assert payload["summary"]["total_anomalies"] >= 1
     groups = {entry["group"] for entry in payload["anomalies"]}
@@ -77,49 +119,195 @@ def test_detect_multi_group_grouped() -> None:
     assert payload["summary"]["groups_impacted"] == len(groups)
 
 
-def test_detect_missing_input_file_returns_exit3() -> None:
-    runner = CliRunner()
+def test_detect_rounds_half_way_values_like_builtin_round(runner: CliRunner) -> None:
+    result = runner.invoke(cli, _detect_args("half_way_rounding.csv"), catch_exceptions=False)
+
+    assert result.exit_code == 0
+    anomaly = json.loads(result.output)["anomalies"][0]
+    assert anomaly["current"] == round(948.64945, 4) == 948.6495
+    assert anomaly["delta"] == round(948.64945 - 100.0, 4)
+
 
-    args = _detect_args("does_not_exist.csv")
-    result = runner.invoke(cli, args)
+def test_detect_missing_input_file_returns_exit3(runner: CliRunner) -> None:
+    result = runner.invoke(cli, _detect_args("does_not_exist.csv"))
 
     assert result.exit_code == 3
     assert "input file error" in result.output.lower()
 
 
-def test_detect_missing_value_column_returns_exit4() -> None:
-    runner = CliRunner()
+@pytest.mark.parametrize("extra_args", [(), ("--streaming",)])
+def test_detect_ragged_row_returns_exit3(runner: CliRunner, extra_args: tuple[str, ...]) -> None:
+    result = runner.invoke(cli, [*_detect_args("ragged_row.csv"), *extra_args])
+
+    assert result.exit_code == 3
+    assert "expected 3 fields in line 3, saw 4" in result.output.lower()
+
 
+def test_detect_missing_value_column_returns_exit4(runner: CliRunner) -> None:
     result = runner.invoke(cli, _detect_args("missing_column.csv"))
 
     assert result.exit_code == 4
     assert "schema/data error" in result.output.lower()
 
 
-def test_detect_non_numeric_value_returns_exit4() -> None:
-    runner = CliRunner()
-
+def test_detect_non_numeric_value_returns_exit4(runner: CliRunner) -> None:
     result = runner.invoke(cli, _detect_args("non_numeric.csv"))
 
     assert result.exit_code == 4
     assert "schema/data error" in result.output.lower()
 
 
-def test_detect_requires_input_and_column_flags_returns_exit2() -> None:
-    runner = CliRunner()
+def test_detect_invalid_timestamp_returns_exit4(runner: CliRunner) -> None:
+    result = runner.invoke(cli, _detect_args("bad_timestamp.csv"))
 
+    assert result.exit_code == 4
+    assert "invalid timestamp values" in result.output
+
+
+def test_detect_requires_input_and_column_flags_returns_exit2(runner: CliRunner) -> None:
     result = runner.invoke(cli, ["detect"])
 
     assert result.exit_code == 2
 
 
-def test_detect_json_mode_stdout_is_valid_json_only() -> None:
-    runner = CliRunner()
-
-    result = runner.invoke(cli, _detect_args("simple_spike.csv"))
+def test_detect_json_mode_stdout_is_valid_json_only(simple_spike_result: tuple[Result, dict]) -> None:
+    result, parsed = simple_spike_result
 
     assert result.exit_code == 0
-    parsed = json.loads(result.output)
     assert parsed["schema_version"] == "1.0"
     assert result.output.strip().startswith("{")
     assert result.output.strip().endswith("}")
+
+
+def test_detect_cache_serves_repeat_runs_without_reparsing(runner: CliRunner, tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.setenv("FINOPS_CACHE", "1")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+
+    first = runner.invoke(cli, _detect_args("simple_spike.csv"), catch_exceptions=False)
+    assert first.exit_code == 0
+    assert len(list((tmp_path / "finops_watchdog").glob("*.npz"))) == 1
+
+    def _fail_read_csv(*_: object, **__: object) -> None:
+        raise AssertionError("cached input should not be reparsed")
+
+    monkeypatch.setattr(pd, "read_csv", _fail_read_csv)
+    second = runner.invoke(cli, _detect_args("simple_spike.csv"), catch_exceptions=False)
+
+    assert second.exit_code == 0
+    assert json.loads(second.output)["anomalies"] == json.loads(first.output)["anomalies"]
+
+
+@pytest.mark.parametrize(
+    "bad_entry",
+    [
+        {"timestamp": np.zeros(3), "value": np.zeros(3), "group_codes": np.zeros(3, int), "group_categories": ["a"]},
+        {
+            "timestamp": np.zeros(2, "datetime64[us]"),
+            "value": np.zeros(3),
+            "group_codes": np.zeros(3, int),
+            "group_categories": ["a"],
+        },
+    ],
+    ids=["wrong-dtype", "length-mismatch"],
+)
+def test_detect_cache_reparses_malformed_entries(
+    runner: CliRunner, tmp_path: Path, monkeypatch, simple_spike_result: tuple[Result, dict], bad_entry: dict
+) -> None:
+    monkeypatch.setenv("FINOPS_CACHE", "1")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert runner.invoke(cli, _detect_args("simple_spike.csv"), catch_exceptions=False).exit_code == 0
+    (entry,) = (tmp_path / "finops_watchdog").glob("*.npz")
+    np.savez(entry, **bad_entry)
+
+    result = runner.invoke(cli, _detect_args("simple_spike.csv"), catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert json.loads(result.output)["anomalies"] == simple_spike_result[1]["anomalies"]
+    assert main._read_cache(entry) is not None
+
+
+def test_detect_cache_replaces_entries_for_an_edited_input(runner: CliRunner, tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.setenv("FINOPS_CACHE", "1")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    source = tmp_path / "cost.csv"
+    source.write_bytes((FIXTURES / "simple_spike.csv").read_bytes())
+    args = list(_detect_args("simple_spike.csv"))
+    args[args.index("--input") + 1] = str(source)
+
+    assert runner.invoke(cli, args, catch_exceptions=False).exit_code == 0
+    os.utime(source, ns=(0, 0))
+    assert runner.invoke(cli, args, catch_exceptions=False).exit_code == 0
+
+    cache_dir = tmp_path / "cache" / "finops_watchdog"
+    assert len(list(cache_dir.glob("*.npz"))) == 1
+    assert stat.S_IMODE(cache_dir.stat().st_mode) == 0o700
+
+
+def test_detect_cache_keeps_entries_per_column_selection(runner: CliRunner, tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.setenv("FINOPS_CACHE", "1")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    source = tmp_path / "cost.csv"
+    pd.read_csv(FIXTURES / "simple_spike.csv").assign(blended=lambda frame: frame["amount"]).to_csv(source, index=False)
+
+    def _args(value_column: str) -> list[str]:
+        args = list(_detect_args("simple_spike.csv"))
+        args[args.index("--input") + 1] = str(source)
+        args[args.index("--value-column") + 1] = value_column
+        return args
+
+    assert runner.invoke(cli, _args("amount"), catch_exceptions=False).exit_code == 0
+    assert runner.invoke(cli, _args("blended"), catch_exceptions=False).exit_code == 0
+    assert len(list((tmp_path / "cache" / "finops_watchdog").glob("*.npz"))) == 2
+
+    def _fail_read_csv(*_: object, **__: object) -> None:
+        raise AssertionError("cached input should not be reparsed")
+
+    monkeypatch.setattr(pd, "read_csv", _fail_read_csv)
+    assert runner.invoke(cli, _args("amount"), catch_exceptions=False).exit_code == 0
+
+
+def test_detect_json_escapes_non_ascii_and_keeps_infinity(runner: CliRunner) -> None:
+    result = runner.invoke(cli, _detect_args("non_ascii_infinite.csv"), catch_exceptions=False)
+
+    assert result.exit_code == 0
+    assert '"group": "Caf\\u00e9"' in result.output
+    assert '"current": Infinity' in result.output
+    assert json.loads(result.output)["anomalies"][0]["group"] == "Café"
+
+
+@pytest.mark.parametrize(
+    ("input_name", "exit_code"),
+    [
+        ("multi_group.csv", 0),
+        # Integer groups in the first chunks and 1.5 in a later one: batch labels every group "1.0".
+        ("streaming_group_dtype.csv", 0),
+        # ISO dates, then US dates from the second chunk on: batch rejects the whole column.
+        ("streaming_time_format.csv", 4),
+    ],
+)
+def test_detect_streaming_matches_batch_across_chunk_boundaries(
+    runner: CliRunner, monkeypatch, input_name: str, exit_code: int
+) -> None:
+    monkeypatch.setattr(main, "_STREAM_CHUNK_ROWS", 3)
+
+    batch = runner.invoke(cli, _detect_args(input_name), catch_exceptions=False)
+    streaming = runner.invoke(cli, [*_detect_args(input_name), "--streaming"], catch_exceptions=False)
+
+    assert batch.exit_code == streaming.exit_code == exit_code
+    assert _without_generated_at(streaming.output) == _without_generated_at(batch.output)
+
+
+def test_detect_streaming_out_of_order_rows_returns_exit4(runner: CliRunner, tmp_path: Path, monkeypatch) -> None:
+    monkeypatch.setattr(main, "_STREAM_CHUNK_ROWS", 2)
+    unordered = tmp_path / "unordered.csv"
+    unordered.write_text(
+        "date,SERVICE,amount\n2026-01-02,AmazonEC2,100\n2026-01-03,AmazonEC2,100\n2026-01-01,AmazonEC2,100\n",
+        encoding="utf-8",
+    )
+    args = list(_detect_args("simple_spike.csv"))
+    args[args.index("--input") + 1] = str(unordered)
+
+    result = runner.invoke(cli, [*args, "--streaming"])
+
+    assert result.exit_code == 4
+    assert "timestamp order" in result.output